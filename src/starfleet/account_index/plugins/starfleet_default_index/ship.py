@@ -8,12 +8,20 @@ file to S3, and this plugin uses that generated file as the basis for the accoun
 :License: See the LICENSE file for details
 :Author: Mike Grima <michael.grima@gemini.com>
 """
-# pylint: disable=too-many-locals,too-many-statements
-import json
-from typing import Set, Dict, Any
+# pylint: disable=too-many-locals,too-many-statements,too-many-instance-attributes
+import os
+import pickle
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import AbstractSet, FrozenSet, Set, Dict, Any, Iterable, List, Tuple
 from sys import intern
+from threading import Lock
 
 import boto3
+import ijson
+import orjson
 from botocore.exceptions import ClientError
 from marshmallow import Schema, fields, ValidationError
 
@@ -22,18 +30,97 @@ from starfleet.utils.configuration import STARFLEET_CONFIGURATION
 from starfleet.utils.logging import LOGGER
 
 
+# A note on interning: the account index repeats the same strings (account IDs, regions, OU IDs/names, tag names/values) across many accounts. All the strings
+# that are stored in the maps are passed through `sys.intern` so that each unique value exists once in memory and is shared across all the maps. This also makes
+# dict lookups cheaper since equal interned strings are the same object, so the key comparison is resolved by identity.
+
+# The index is fetched in byte-range parts of this size. This matches the default multipart chunk size that boto3 uses for S3 transfers:
+INDEX_PART_SIZE = 8 * 1024 * 1024
+INDEX_DOWNLOAD_CONCURRENCY = 8
+INDEX_READ_CHUNK_SIZE = 64 * 1024
+
+# Shared empty set that is returned for lookups that have no accounts:
+_EMPTY: FrozenSet[str] = frozenset()
+
+# The loaded index attributes that are saved to (and restored from) the local index cache file:
+_CACHED_ATTRIBUTES = ("org_root", "account_ids", "alias_map", "ou_map", "regions_map", "tag_map")
+
+# This is bumped whenever the contents of the cache file change so that a cache written by a different version of this plugin is never used:
+_CACHE_FORMAT_VERSION = 1
+
+
 class StarfleetDefaultAccountIndexSchema(Schema):
     """This is the configuration schema required for the StarfleetDefaultAccountIndex."""
 
     index_bucket = fields.String(required=True, data_key="IndexBucket")
     bucket_region = fields.String(required=True, data_key="BucketRegion")
     index_object_path = fields.String(required=False, data_key="IndexObjectPath", load_default="accountIndex.json")
+    index_cache_path = fields.String(required=False, data_key="IndexCachePath", load_default=None)
 
 
 class MissingConfigurationError(Exception):
     """Exception raised if the configuration for the StarfleetDefaultAccountIndex configuration entry is missing."""
 
 
+class InvalidAccountArnError(Exception):
+    """Exception raised if the Organization root account ID can't be parsed out of an account's ARN in the index."""
+
+
+class MissingAccountsError(Exception):
+    """Exception raised if no accounts were read from the index. This is the case if the index is missing the `accounts` section or it's empty."""
+
+
+class IncompleteIndexDownloadError(Exception):
+    """Exception raised if a part of the index that was downloaded from S3 doesn't match the size of the byte range that was requested."""
+
+
+@lru_cache(maxsize=8)
+def _get_s3_client(region: str) -> Any:
+    """
+    Return back the S3 client for the given region. Creating a boto3 client loads the service model and resolves endpoints, which is slow, so the client is made
+    once per region and re-used for the life of the process.
+    """
+    return boto3.client("s3", region_name=region)
+
+
+def _download_parallel(
+    client: Any, bucket: str, key: str, etag: str, total_length: int, part_size: int = INDEX_PART_SIZE, concurrency: int = INDEX_DOWNLOAD_CONCURRENCY
+) -> bytearray:
+    """
+    This will download the S3 object in byte-range parts concurrently. A single GET is bottlenecked on the throughput of 1 HTTP connection, so for larger indexes
+    this fetches each part at the same time and writes it into a pre-allocated buffer at its offset (this avoids concatenating all the parts together after).
+
+    Every part is pinned to the given ETag (the version of the object that was measured with HeadObject). If the object is re-written during the download, S3 will
+    reject the request rather than allow parts of 2 different versions to be stitched together.
+    """
+    buffer = bytearray(total_length)
+
+    with memoryview(buffer) as view:
+
+        def fetch_part(start: int) -> None:
+            """
+            Fetch the part of the object that begins at the given offset and place it into the buffer. The body is copied over in small chunks as it streams in so that
+            the whole part is never held in memory a second time.
+            """
+            end = min(start + part_size, total_length) - 1
+            offset = start
+            body = client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}", IfMatch=etag)["Body"]
+            for chunk in body.iter_chunks(chunk_size=INDEX_READ_CHUNK_SIZE):
+                if offset + len(chunk) > end + 1:
+                    raise IncompleteIndexDownloadError(f"Received more than the requested byte range: {start}-{end}")
+                view[offset : offset + len(chunk)] = chunk
+                offset += len(chunk)
+
+            if offset != end + 1:
+                raise IncompleteIndexDownloadError(f"Received {offset - start} bytes for the byte range: {start}-{end}, expected {end + 1 - start} bytes")
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # Consume the results so that any exceptions raised in the threads are re-raised here:
+            list(executor.map(fetch_part, range(0, total_length, part_size)))
+
+    return buffer
+
+
 class StarfleetDefaultAccountIndex(AccountIndex):
     """
     This is the default account index plugin that uses the generated account index from the AccountIndexGeneratorShip Starfleet Worker Ship.
@@ -43,27 +130,24 @@ class StarfleetDefaultAccountIndex(AccountIndex):
 
     def __init__(self):
         """
-        This will go out to S3 and load the configuration that is needed. Since this has a dependency on the AccountIndexGeneratorShip worker to generate the files to S3.
+        This will load and verify the configuration that is needed. Since this has a dependency on the AccountIndexGeneratorShip worker to generate the files to S3.
         This will need a configuration that tells it where to download the Account Index JSON.
+
+        The index itself is not fetched from S3 until it is first queried. This way, nothing that instantiates the plugin without querying it pays for the download.
         """
         self.org_root = ""
-        self.account_ids = set()
+        self.account_ids: FrozenSet[str] = frozenset()
         self.alias_map: Dict[str, str] = {}
-        self.ou_map: Dict[str, Set[str]] = {}
-        self.regions_map: Dict[str, Set[str]] = {}
-        self.tag_map: Dict[str, Dict[str, Set[str]]] = {}  # Dict of tag name -> tag value -> accounts
+        self.ou_map: Dict[str, FrozenSet[str]] = {}
+        self.regions_map: Dict[str, FrozenSet[str]] = {}
+        self.tag_map: Dict[str, Dict[str, FrozenSet[str]]] = {}  # Dict of tag name -> tag value -> accounts
 
-        LOGGER.debug("[⚙️] Loading the StarfleetDefaultAccountIndex...")
-        try:
-            config = StarfleetDefaultAccountIndexSchema().load(STARFLEET_CONFIGURATION.config["StarfleetDefaultAccountIndex"])
+        self._loaded = False
+        self._lock = Lock()
 
-            LOGGER.debug(
-                f"[🪣] Fetching the index from the S3 bucket: {config['index_bucket']}, region: {config['bucket_region']}, path: {config['index_object_path']}..."
-            )
-            client = boto3.client("s3", region_name=config["bucket_region"])
-            account_dict = json.loads(client.get_object(Bucket=config["index_bucket"], Key=config["index_object_path"])["Body"].read())["accounts"]
-            self._load_inventory(account_dict)
-            LOGGER.debug("[🆗] Index loaded.")
+        LOGGER.debug("[⚙️] Loading the StarfleetDefaultAccountIndex configuration...")
+        try:
+            self._config = StarfleetDefaultAccountIndexSchema().load(STARFLEET_CONFIGURATION.config["StarfleetDefaultAccountIndex"])
 
         except KeyError as kerr:
             LOGGER.error("[💥] Missing the StarfleetDefaultAccountIndex configuration field in the configuration YAMLs. Cannot proceed.")
@@ -74,6 +158,46 @@ class StarfleetDefaultAccountIndex(AccountIndex):
             LOGGER.exception(verr)
             raise
 
+    def _ensure_loaded(self) -> None:
+        """This will load the index from S3 if it hasn't been loaded yet. This is called at the top of each of the query functions."""
+        if not self._loaded:
+            with self._lock:
+                # Check again in case another thread loaded it while we were waiting on the lock:
+                if not self._loaded:
+                    self._load_index()
+                    self._loaded = True
+
+    def _load_index(self) -> None:
+        """This will go out to S3 and download the index, and then load the inventory from it."""
+        config = self._config
+        LOGGER.debug("[⚙️] Loading the StarfleetDefaultAccountIndex...")
+        try:
+            LOGGER.debug(
+                f"[🪣] Fetching the index from the S3 bucket: {config['index_bucket']}, region: {config['bucket_region']}, path: {config['index_object_path']}..."
+            )
+            client = _get_s3_client(config["bucket_region"])
+            index_head = client.head_object(Bucket=config["index_bucket"], Key=config["index_object_path"])
+            index_size = index_head["ContentLength"]
+
+            # If a local cache is configured and it was made from this exact version of the index, then just use that:
+            if config["index_cache_path"] and self._load_from_cache(config["index_cache_path"], index_head["ETag"]):
+                LOGGER.debug(f"[🆗] Index loaded from the local cache: {config['index_cache_path']}.")
+                return
+
+            # Small indexes are just fetched with 1 GET and are stream-parsed so that each account is processed as it's decoded -- the full JSON document is
+            # never loaded into memory at once:
+            if index_size < INDEX_PART_SIZE:
+                index_body = client.get_object(Bucket=config["index_bucket"], Key=config["index_object_path"], IfMatch=index_head["ETag"])["Body"]
+                self._load_inventory(ijson.kvitems(index_body, "accounts"))
+
+            # Larger ones are fetched in parallel parts. Since the whole document is then already in memory, it's decoded in one go with orjson, which is much faster
+            # than stream-parsing it:
+            else:
+                LOGGER.debug(f"[🪣] The index is {index_size} bytes -- fetching it in parallel parts...")
+                index_buffer = _download_parallel(client, config["index_bucket"], config["index_object_path"], index_head["ETag"], index_size)
+                self._load_inventory(orjson.loads(index_buffer).get("accounts", {}).items())
+            LOGGER.debug("[🆗] Index loaded.")
+
         except ClientError as cerr:
             LOGGER.error("[💥] Unable to fetch the index object from S3. Error details:")
             LOGGER.exception(cerr)
@@ -86,89 +210,195 @@ class StarfleetDefaultAccountIndex(AccountIndex):
             LOGGER.exception(exc)
             raise
 
-    def _load_inventory(self, account_dict: Dict[str, Any]) -> None:
-        """Utility function to perform all the inventory loading."""
+        if config["index_cache_path"]:
+            self._save_to_cache(config["index_cache_path"], index_head["ETag"])
+
+    def _cache_source(self) -> str:
+        """This is the S3 location of the index. This is saved in the cache file so that a cache from a different index is never used."""
+        return f"{self._config['index_bucket']}/{self._config['index_object_path']}"
+
+    def _load_from_cache(self, cache_path: str, etag: str) -> bool:
+        """
+        This will attempt to load the index from the local cache file. This returns True if the cache was made from the same S3 object (source path and ETag) and
+        was loaded. This returns False if the cache is missing, stale, or can't be read -- in that case the index needs to be fetched from S3.
+        """
+        try:
+            with open(cache_path, "rb") as file:
+                cached = pickle.load(file)
+
+        except FileNotFoundError:
+            return False
+
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, IndexError, ValueError) as exc:
+            LOGGER.warning(f"[⚠️] Unable to read the local index cache: {cache_path}. The index will be fetched from S3. Error details: {exc}")
+            return False
+
+        # Verify the entire cache before setting anything so that a partial cache never leaves the index half-loaded:
+        if not isinstance(cached, dict) or cached.get("version") != _CACHE_FORMAT_VERSION or any(attribute not in cached for attribute in _CACHED_ATTRIBUTES):
+            LOGGER.warning(f"[⚠️] The local index cache: {cache_path} is not in the expected format. The index will be fetched from S3.")
+            return False
+
+        if cached.get("source") != self._cache_source() or cached.get("etag") != etag:
+            LOGGER.debug("[🗑️] The local index cache is out of date.")
+            return False
+
+        for attribute in _CACHED_ATTRIBUTES:
+            setattr(self, attribute, cached[attribute])
+
+        return True
+
+    def _save_to_cache(self, cache_path: str, etag: str) -> None:
+        """This will save the loaded index to the local cache file. Failing to write the cache is not fatal since the index is already loaded."""
+        cached = {"version": _CACHE_FORMAT_VERSION, "source": self._cache_source(), "etag": etag}
+        for attribute in _CACHED_ATTRIBUTES:
+            cached[attribute] = getattr(self, attribute)
+
+        temp_path = None
+        try:
+            # Write to a temporary file and move it into place so that a partially written cache is never read:
+            file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_path)))
+            with os.fdopen(file_descriptor, "wb") as file:
+                pickle.dump(cached, file, protocol=5)
+            os.replace(temp_path, cache_path)
+
+            LOGGER.debug(f"[💾] Saved the index to the local cache: {cache_path}.")
+
+        except (OSError, pickle.PicklingError) as exc:
+            LOGGER.warning(f"[⚠️] Unable to save the local index cache: {cache_path}. Error details: {exc}")
+
+        finally:
+            # The temporary file is only left behind if it was not moved into place:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _load_inventory(self, accounts: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        """Utility function to perform all the inventory loading. This receives an iterable of the account ID and account details from the index."""
+        # The mappings are built as defaultdicts so that each insert is a single lookup. These are converted to normal dicts of frozensets once everything is loaded:
+        org_root = ""
+        account_ids: List[str] = []
+        alias_map: Dict[str, str] = {}
+        regions_map: Dict[str, Set[str]] = defaultdict(set)
+        ou_map: Dict[str, Set[str]] = defaultdict(set)
+        ou_names: Dict[str, str] = {}
+        tag_map: Dict[str, Dict[str, Set[str]]] = defaultdict(lambda: defaultdict(set))
+
+        # Bind the functions that are called for every account to locals -- this avoids a global or attribute lookup on each call in the loop below:
+        _intern = intern
+        _lower = str.lower
+        _append_account_id = account_ids.append
+
+        # The same OU IDs, OU names, and tag names/values show up across many accounts, so each unique string is only lower-cased once:
+        lower_cache: Dict[str, str] = {}
+        _get_cached_lower = lower_cache.get
+
+        def lower(value: str) -> str:
+            """Return back the (interned) lower-cased version of the value, and cache it for the next time the same value is encountered."""
+            lowered = _get_cached_lower(value)
+            if lowered is None:
+                lowered = lower_cache[value] = _intern(_lower(value))
+
+            return lowered
+
         # Generate the mappings:
-        for account_id, account in account_dict.items():
-            # Add to the Account ID Mapping:
-            self.account_ids.add(intern(account_id))  # Using intern for all IDs for memory and performance -- which might improve things?
+        for account_id, account in accounts:
+            # This worker operates in one AWS Org. The Organization root is in the ARN for an account in the Org, and looks like this:
+            # arn:aws:organizations::ORG-ROOT-ACCOUNT-ID:account/ORG-ID/ACCOUNT-ID
+            #                        ^^ We are going to pull this out of the first account in the index.
+            if not org_root:
+                org_root = account["Arn"].partition("arn:aws:organizations::")[2].partition(":")[0]
+                if not org_root:
+                    # If this is not caught, then the org root would never be excluded from templates that aren't supposed to operate in it:
+                    raise InvalidAccountArnError(f"Unable to parse the Organization root account ID out of the account ARN: {account['Arn']}")
+
+            # Intern the account ID once -- this same string is what gets added to all the mappings:
+            aid = _intern(account_id)
+            _append_account_id(aid)
 
             # Create the proper mapping for each account alias:
-            self.alias_map[account["Name"].lower()] = intern(account_id)
+            alias_map[_intern(_lower(account["Name"]))] = aid
             # TODO: Add in something with an alias tag to populate this
 
             # Create the regions mapping:
             for region in account["Regions"]:
-                mapping = self.regions_map.get(region, set())
-                mapping.add(intern(account_id))
-                self.regions_map[region] = mapping
+                regions_map[_intern(region)].add(aid)
 
             # Create the OU mapping:
             for org_unit in account["Parents"]:
                 # We are assuming that the OU names and IDs are not the same LOL
-                ou_id = org_unit["Id"].lower()
-                ou_name = org_unit["Name"].lower()
-                mapping_id = self.ou_map.get(ou_id, set())
-                mapping_name = self.ou_map.get(ou_name, set())
-                mapping_id.add(intern(account_id))
-                mapping_name.add(intern(account_id))
-                self.ou_map[ou_id] = mapping_id
-                self.ou_map[ou_name] = mapping_id
+                # The accounts are only tracked by OU ID here. OU names are only unique among sibling OUs, so the names are mapped once everything is loaded:
+                ou_id = lower(org_unit["Id"])
+                ou_map[ou_id].add(aid)
+                ou_names[ou_id] = lower(org_unit["Name"])
 
             # Create the tag mapping:
             for tag_name, tag_value in account["Tags"].items():
-                norm_tag_name = tag_name.lower()
-                norm_tag_value = tag_value.lower()
-                tag_name_mapping = self.tag_map.get(norm_tag_name, {})
-                tag_value_mapping = tag_name_mapping.get(norm_tag_value, set())
-                tag_value_mapping.add(intern(account_id))
-                tag_name_mapping[norm_tag_value] = tag_value_mapping
-                self.tag_map[norm_tag_name] = tag_name_mapping
-
-        # This worker operates in one AWS Org. The Organization root is in the ARN for an account in the Org, and looks like this:
-        # arn:aws:organizations::ORG-ROOT-ACCOUNT-ID:account/ORG-ID/ACCOUNT-ID
-        #                        ^^ We are going to pull this out of the last account in the list.
-
-        # Pull out the first account in the dict and parse out the ARN:
-        some_account = next(iter(account_dict.values()))
-        self.org_root = some_account["Arn"].split("arn:aws:organizations::")[1].split(":")[0]
+                norm_tag_name = lower(tag_name)
+                norm_tag_value = lower(tag_value)
+                tag_map[norm_tag_name][norm_tag_value].add(aid)
+
+        # The stream parser yields nothing if the `accounts` section is missing, so this needs to be checked for here:
+        if not org_root:
+            raise MissingAccountsError(
+                "No accounts were found in the index. Note: This *NEEDS* to be the object generated by the AccountIndexGeneratorShip plugin."
+            )
+
+        # Convert the defaultdicts back to normal dicts so that lookups on missing keys don't add empty entries. The account sets are frozen so that they can be
+        # returned directly to callers without the risk of the index being modified:
+        self.org_root = org_root
+        self.account_ids = frozenset(account_ids)
+        self.alias_map = alias_map
+        self.regions_map = {region: frozenset(account_set) for region, account_set in regions_map.items()}
+        self.tag_map = {
+            tag_name: {tag_value: frozenset(account_set) for tag_value, account_set in tag_values.items()} for tag_name, tag_values in tag_map.items()
+        }
+
+        # An OU name maps to all the accounts in all the OUs with that name. Most OU names are unique, so that OU name just shares the frozenset of the OU ID:
+        self.ou_map = {ou_id: frozenset(account_set) for ou_id, account_set in ou_map.items()}
+        name_ou_ids: Dict[str, List[str]] = defaultdict(list)
+        for ou_id, ou_name in ou_names.items():
+            name_ou_ids[ou_name].append(ou_id)
+        for ou_name, ou_ids in name_ou_ids.items():
+            if len(ou_ids) == 1:
+                self.ou_map[ou_name] = self.ou_map[ou_ids[0]]
+            else:
+                self.ou_map[ou_name] = frozenset().union(*(self.ou_map[ou_id] for ou_id in ou_ids))
 
     def get_accounts_by_ids(self, ids: Set[str]) -> Set[str]:
         """Return back a Set of account IDs for a given Set of IDs present -- this effectively only returns back account IDs that exist in the inventory."""
+        self._ensure_loaded()
         return ids.intersection(self.account_ids)
 
     def get_accounts_by_aliases(self, aliases: Set[str]) -> Set[str]:
         """Return back a Set of account IDs for a given Set of aliases"""
-        accounts = set()
-        for alias in aliases:
-            account = self.alias_map.get(alias.lower(), None)
-            if account:
-                accounts.add(account)
-
-        return accounts
+        self._ensure_loaded()
+        # Intersecting with the keys view finds the aliases that exist in the index without a Python-level lookup loop:
+        lowered = {alias.lower() for alias in aliases}
+        return {self.alias_map[alias] for alias in self.alias_map.keys() & lowered}
 
-    def get_accounts_by_tag(self, tag_name: str, tag_value: str) -> Set[str]:
+    def get_accounts_by_tag(self, tag_name: str, tag_value: str) -> FrozenSet[str]:
         """Return back a set of account IDs based on the tag name and value pair"""
-        return self.tag_map.get(tag_name.lower(), {}).get(tag_value.lower(), set())
+        self._ensure_loaded()
+        return self.tag_map.get(tag_name.lower(), {}).get(tag_value.lower(), _EMPTY)
 
-    def get_accounts_by_ou(self, org_unit: str) -> Set[str]:
+    def get_accounts_by_ou(self, org_unit: str) -> FrozenSet[str]:
         """Return back a set of account IDs based on the OU membership"""
-        return self.ou_map.get(org_unit.lower(), set())
+        self._ensure_loaded()
+        return self.ou_map.get(org_unit.lower(), _EMPTY)
 
-    def get_accounts_by_regions(self, regions: Set[str]) -> Dict[str, Set[str]]:
+    def get_accounts_by_regions(self, regions: Set[str]) -> Dict[str, AbstractSet[str]]:
         """Return back a dictionary of the region and the set of accounts associated with it."""
-        mapping = {}
-        for region in regions:
-            mapping[region] = self.regions_map.get(region, set())
-
-        return mapping
+        self._ensure_loaded()
+        regions_map = self.regions_map
+        return {region: regions_map.get(region, _EMPTY) for region in regions}
 
-    def get_accounts_for_all_regions(self) -> Dict[str, Set[str]]:
+    def get_accounts_for_all_regions(self) -> Dict[str, AbstractSet[str]]:
         """Return back a dictionary of the region and the set of all accounts associated with it -- but for ALL regions."""
+        self._ensure_loaded()
         return self.regions_map
 
-    def get_all_accounts(self) -> Set[str]:
+    def get_all_accounts(self) -> FrozenSet[str]:
         """Return back a set of all account IDs."""
+        self._ensure_loaded()
         return self.account_ids
 
     def get_org_roots(self) -> Set[str]:
@@ -179,4 +409,5 @@ class StarfleetDefaultAccountIndex(AccountIndex):
 
         Note: This AccountIndex plugin assumes that there is exactly 1 AWS Organization that is being used.
         """
+        self._ensure_loaded()
         return {self.org_root}
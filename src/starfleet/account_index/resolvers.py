@@ -7,14 +7,14 @@ This defines the account resolution logic for account and account/region templat
 :License: See the LICENSE file for details
 :Author: Mike Grima <michael.grima@gemini.com>
 """
-from typing import Any, Dict, Set
+from typing import AbstractSet, Any, Dict, Set
 
 from starfleet.account_index.loader import ACCOUNT_INDEX
 from starfleet.utils.configuration import STARFLEET_CONFIGURATION
 from starfleet.utils.logging import LOGGER
 
 
-def resolve_worker_template_accounts(loaded_template: Dict[str, Any]) -> Set[str]:
+def resolve_worker_template_accounts(loaded_template: Dict[str, Any]) -> AbstractSet[str]:
     """
     This will resolve the accounts that a given worker template is supposed to operate on. This receives a deserialized dictionary that was based on the
     `starfleet.worker_ships.base_payload_schemas.BaseAccountPayloadTemplate` (or a subclass or equivalent).
@@ -82,7 +82,7 @@ def resolve_worker_template_account_regions(loaded_template: Dict[str, Any], org
     return account_region_map
 
 
-def resolve_include_exclude(loaded_template: Dict[str, Any]) -> Set[str]:
+def resolve_include_exclude(loaded_template: Dict[str, Any]) -> AbstractSet[str]:
     """
     This will resolve accounts that are included and excluded. This will return a set of accounts that are effectively included (sans the excluded accounts).
     This receives a deserialized dictionary that was based on the `starfleet.worker_ships.base_payload_schemas.BaseAccountPayloadTemplate` (or a subclass or equivalent).
@@ -120,7 +120,7 @@ def resolve_account_specification(account_spec: Dict[str, Any]) -> Set[str]:
     return account_set
 
 
-def resolve_include_account_specification(include_account_spec: Dict[str, Any]) -> Set[str]:
+def resolve_include_account_specification(include_account_spec: Dict[str, Any]) -> AbstractSet[str]:
     """
     This is exactly like the `resolve_account_specification` but this one handles the `IncludeAccounts` portion of the template. This basically calls out to the
     `resolve_account_specification` function above while also performing the `AllAccounts: True` logic.
@@ -8,7 +8,7 @@ This is what allows the Starbase to properly task Account and Account-Region pay
 :License: See the LICENSE file for details
 :Author: Mike Grima <michael.grima@gemini.com>
 """
-from typing import Set, Dict, TypeVar
+from typing import AbstractSet, Set, Dict, TypeVar
 
 
 class AccountIndex:  # pragma: no cover
@@ -16,37 +16,39 @@ class AccountIndex:  # pragma: no cover
     This is the base class that ALL account index plugins in Starfleet need to subclass.
 
     Make sure that you put your boostrapping code in the __init__ function. That is where you will want to do things like load the configuration, or load up the index.
+
+    The returned account sets are read-only. Implementations can (and the default index does) return frozensets, so callers that need to modify them must copy them first.
     """
 
-    def get_accounts_by_ids(self, ids: Set[str]) -> Set[str]:
+    def get_accounts_by_ids(self, ids: Set[str]) -> AbstractSet[str]:
         """Return back a Set of account IDs for a given set of IDs present -- this effectively only returns back account IDs that exist in the inventory."""
         raise NotImplementedError("Pew Pew Pew")
 
-    def get_accounts_by_aliases(self, aliases: Set[str]) -> Set[str]:
+    def get_accounts_by_aliases(self, aliases: Set[str]) -> AbstractSet[str]:
         """Return back a Set of account IDs for a given set of aliases"""
         raise NotImplementedError("Pew Pew Pew")
 
-    def get_accounts_by_tag(self, tag_name: str, tag_value: str) -> Set[str]:
+    def get_accounts_by_tag(self, tag_name: str, tag_value: str) -> AbstractSet[str]:
         """Return back a set of account IDs based on the tag name and value pair"""
         raise NotImplementedError("Pew Pew Pew")
 
-    def get_accounts_by_ou(self, org_unit: str) -> Set[str]:
+    def get_accounts_by_ou(self, org_unit: str) -> AbstractSet[str]:
         """Return back a set of account IDs based on the OU membership"""
         raise NotImplementedError("Pew Pew Pew")
 
-    def get_accounts_by_regions(self, regions: Set[str]) -> Dict[str, Set[str]]:
+    def get_accounts_by_regions(self, regions: Set[str]) -> Dict[str, AbstractSet[str]]:
         """Return back a dictionary of the region and the set of accounts associated with it."""
         raise NotImplementedError("Pew Pew Pew")
 
-    def get_accounts_for_all_regions(self) -> Dict[str, Set[str]]:
+    def get_accounts_for_all_regions(self) -> Dict[str, AbstractSet[str]]:
         """Return back a dictionary of the region and the set of all accounts associated with it -- but for ALL regions."""
         raise NotImplementedError("Pew Pew Pew")
 
-    def get_all_accounts(self) -> Set[str]:
+    def get_all_accounts(self) -> AbstractSet[str]:
         """Return back a set of all account IDs."""
         raise NotImplementedError("Pew Pew Pew")
 
-    def get_org_roots(self) -> Set[str]:
+    def get_org_roots(self) -> AbstractSet[str]:
         """
         Return back the set of account IDs for Organization Root accounts. This is mostly used for the Account and Account/Region worker ships when specifying if the payload
         in question should operate in an AWS Organization Root account. If the flag in the template is set, then this will check if there is an Organization Root set and task a
@@ -175,9 +175,8 @@ def test_resolve_worker_templates_disabled_regions(test_index: AccountIndexInsta
 
     all_regions = set(boto3.session.Session().get_available_regions("ec2"))
 
-    # Disable in 2 accounts:
-    test_index.regions_map["ap-east-1"].remove("000000000001")
-    test_index.regions_map["ap-east-1"].remove("000000000002")
+    # Disable in 2 accounts (the index's sets are frozen, so swap in a new one):
+    test_index.regions_map["ap-east-1"] = test_index.regions_map["ap-east-1"] - {"000000000001", "000000000002"}
 
     payload = """
         TemplateName: SomeAccountsAllRegions
@@ -8,7 +8,7 @@ Sample account index plugin for unit testing purposes.
 :Author: Mike Grima <michael.grima@gemini.com>
 """
 import json
-from typing import Dict, Set
+from typing import Dict, FrozenSet
 
 from starfleet.account_index.plugins.starfleet_default_index import StarfleetDefaultAccountIndex
 import tests.starfleet_included_plugins.account_index_generator
@@ -20,17 +20,19 @@ class TestingAccountIndexPlugin(StarfleetDefaultAccountIndex):
     # Intentionally not calling the super __init__ in this function (to not reach out to S3):
     def __init__(self):  # noqa pylint: disable=super-init-not-called
         """This will load the generatedIndex.json file that is used by the tests.starfleet_included_plugins.account_index_generator tests."""
-        self.account_ids = set()
+        self.org_root = ""
+        self.account_ids: FrozenSet[str] = frozenset()
         self.alias_map: Dict[str, str] = {}
-        self.ou_map: Dict[str, Set[str]] = {}
-        self.regions_map: Dict[str, Set[str]] = {}
-        self.tag_map: Dict[str, Dict[str, Set[str]]] = {}  # Dict of tag name -> tag value -> accounts
+        self.ou_map: Dict[str, FrozenSet[str]] = {}
+        self.regions_map: Dict[str, FrozenSet[str]] = {}
+        self.tag_map: Dict[str, Dict[str, FrozenSet[str]]] = {}  # Dict of tag name -> tag value -> accounts
 
         path = f"{tests.starfleet_included_plugins.account_index_generator.__path__[0]}/generatedIndex.json"
         with open(path, "r", encoding="utf-8") as file:
             account_dict = json.loads(file.read())["accounts"]
 
-        self._load_inventory(account_dict)
+        self._load_inventory(account_dict.items())
+        self._loaded = True  # Already loaded, so the index won't try to fetch from S3
 
 
 ACCOUNT_INDEX_PLUGINS = [TestingAccountIndexPlugin]
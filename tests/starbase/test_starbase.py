@@ -209,7 +209,7 @@ def test_fan_out_account(
     # Iterate through and verify that everything is correct. Also verify and confirm that we are not tasking the org root (Account 20), and Account 1 which is explicitly
     # excluded in the template by name:
     worker = account_worker_ships.get_worker_ships()["TestingStarfleetWorkerPlugin"]
-    all_accounts = test_index.get_all_accounts()
+    all_accounts = set(test_index.get_all_accounts())  # The index returns frozensets, so make a copy that we can modify
     for message in all_messages:
         worker.load_template(json.loads(message["Body"]))
         # Remove the seen accounts. If not found, this will raise an exception. At the end only 2 accounts should remain (20, and 1) which are excluded:
@@ -384,7 +384,8 @@ def test_fan_out_account_regions(
     # Iterate through and verify that everything is correct. Also verify and confirm that we are not tasking the org root (Account 20), and Account 1 which is explicitly
     # excluded in the template by name:
     worker = account_region_worker_ships.get_worker_ships()["TestingStarfleetWorkerPlugin"]
-    all_accounts_regions = test_index.get_accounts_by_regions({"us-west-1", "us-east-1", "us-east-2", "eu-west-1", "ca-central-1"})
+    regions = {"us-west-1", "us-east-1", "us-east-2", "eu-west-1", "ca-central-1"}
+    all_accounts_regions = {region: set(accounts) for region, accounts in test_index.get_accounts_by_regions(regions).items()}  # Modifiable copies of the sets
     for message in all_messages:
         worker.load_template(json.loads(message["Body"]))
         # Remove the seen account/regions. If not found, this will raise an exception.
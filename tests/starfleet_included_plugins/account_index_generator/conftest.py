@@ -24,9 +24,14 @@ from moto import mock_ec2, mock_s3
 @pytest.fixture
 def aws_s3(aws_credentials: None) -> Generator[BaseClient, None, None]:
     """This is a fixture for a Moto wrapped AWS S3 mock for the entire unit test."""
+    from starfleet.account_index.plugins.starfleet_default_index.ship import _get_s3_client
+
     with mock_s3():
         yield boto3.client("s3", region_name="us-east-2")  # Assuming that our deployment region for everything is us-east-2.
 
+        # The default account index caches its S3 client -- clear it so that a client made under this mock is not reused by other tests:
+        _get_s3_client.cache_clear()
+
 
 @pytest.fixture
 def aws_ec2(aws_credentials: None) -> Generator[BaseClient, None, None]:
@@ -8,8 +8,12 @@ This defines all the tests used by the Default Account Index
 :Author: Mike Grima <michael.grima@gemini.com>
 """
 # pylint: disable=unused-argument,too-many-locals
+import json
+import pickle
 from datetime import datetime
 from typing import Any, Dict
+from unittest import mock
+from unittest.mock import MagicMock
 
 import pytest
 from botocore.client import BaseClient
@@ -39,23 +43,77 @@ def test_invalid_configuration(account_index_config: Dict[str, Any]) -> None:
 
 def test_missing_s3_object(account_index_config: Dict[str, Any]) -> None:
     """This tests that we handle missing S3 objects."""
+    index = StarfleetDefaultAccountIndex()  # The index isn't fetched from S3 until it's queried
     with pytest.raises(ClientError) as cerr:
-        StarfleetDefaultAccountIndex()
-    assert cerr.typename == "NoSuchKey"
+        index.get_all_accounts()
+    assert cerr.value.response["Error"]["Code"] == "404"  # The HeadObject call returns a 404 vs. a NoSuchKey
 
 
 def test_invalid_json(account_index_config: Dict[str, Any], aws_s3: BaseClient, inventory_bucket: str) -> None:
     """This tests that we naively handle an improper JSON index."""
     aws_s3.put_object(Bucket=inventory_bucket, Key="accountIndex.json", Body=b"a")
 
+    index = StarfleetDefaultAccountIndex()
     with pytest.raises(Exception) as exc:
-        StarfleetDefaultAccountIndex()
-    assert str(exc.value) == "Expecting value: line 1 column 1 (char 0)"
+        index.get_all_accounts()
+    assert exc.typename == "IncompleteJSONError"
+
+
+def test_invalid_account_arn(account_index_config: Dict[str, Any], aws_s3: BaseClient, inventory_bucket: str, index_obj: Dict[str, Any]) -> None:
+    """This tests that we fail to load the index if the Organization root can't be parsed out of the account ARNs."""
+    from starfleet.account_index.plugins.starfleet_default_index.ship import InvalidAccountArnError
+
+    for account in index_obj["accounts"].values():
+        account["Arn"] = account["Arn"].replace("arn:aws:", "arn:aws-us-gov:")
+    aws_s3.put_object(Bucket=inventory_bucket, Key="accountIndex.json", Body=json.dumps(index_obj))
+
+    index = StarfleetDefaultAccountIndex()
+    with pytest.raises(InvalidAccountArnError):
+        index.get_org_roots()
+
+
+def test_missing_accounts(account_index_config: Dict[str, Any], aws_s3: BaseClient, inventory_bucket: str, index_obj: Dict[str, Any]) -> None:
+    """This tests that we fail to load an index that doesn't have any accounts in it -- for both the stream-parsed and parallel downloaded paths."""
+    from starfleet.account_index.plugins.starfleet_default_index.ship import MissingAccountsError
+
+    for bad_index in [{"generated": index_obj["generated"], "Accounts": index_obj["accounts"]}, {"generated": index_obj["generated"], "accounts": {}}]:
+        aws_s3.put_object(Bucket=inventory_bucket, Key="accountIndex.json", Body=json.dumps(bad_index))
+        with pytest.raises(MissingAccountsError):
+            StarfleetDefaultAccountIndex().get_org_roots()
+
+        with mock.patch("starfleet.account_index.plugins.starfleet_default_index.ship.INDEX_PART_SIZE", 10):
+            with pytest.raises(MissingAccountsError):
+                StarfleetDefaultAccountIndex().get_org_roots()
+
+
+def test_failed_load_is_discarded(account_index_config: Dict[str, Any], aws_s3: BaseClient, inventory_bucket: str, index_obj: Dict[str, Any]) -> None:
+    """This tests that nothing from an index load that failed partway through is kept around for the next load."""
+    # Break the last account in the index so that the load fails after the other accounts were processed:
+    good_index = json.loads(json.dumps(index_obj))
+    index_obj["accounts"]["000000000023"] = {"Arn": index_obj["accounts"]["000000000001"]["Arn"], "Name": "Account 23"}
+    aws_s3.put_object(Bucket=inventory_bucket, Key="accountIndex.json", Body=json.dumps(index_obj))
+
+    index = StarfleetDefaultAccountIndex()
+    with pytest.raises(KeyError):
+        index.get_all_accounts()
+    assert not index._loaded
+
+    # Fix the index and also remove an account. The removed account should not be resolvable by any of the partially loaded details:
+    good_index["accounts"].pop("000000000001")
+    aws_s3.put_object(Bucket=inventory_bucket, Key="accountIndex.json", Body=json.dumps(good_index))
+    assert len(index.get_all_accounts()) == len(good_index["accounts"].keys())
+    assert not index.get_accounts_by_aliases({"Account 1", "Account 23"})
 
 
 def test_loading(account_index_config: Dict[str, Any], aws_s3: BaseClient, inventory_bucket: str, index_obj: Dict[str, Any]) -> None:
     """This tests that the index can be successfully loaded and that the index_obj fixture works."""
     index = StarfleetDefaultAccountIndex()
+
+    # The index is lazy loaded -- nothing is fetched until the index is queried:
+    assert not index._loaded
+    assert not index.account_ids
+    index.get_all_accounts()
+    assert index._loaded
     assert datetime.strptime(index_obj["generated"], "%Y-%m-%dT%H:%M:%SZ")
     account_map = index_obj["accounts"]
     assert len(index.account_ids) == len(account_map.keys())
@@ -66,12 +124,121 @@ def test_loading(account_index_config: Dict[str, Any], aws_s3: BaseClient, inven
 
     assert len(index.ou_map["r-123456"]) == len(index.ou_map["ROOT".lower()]) == len(account_map.keys())
     assert len(index.ou_map["ou-1234-5678910"]) == len(index.ou_map["SomeOU".lower()]) == len(account_map.keys()) - 1
+    assert index.ou_map["ou-1234-5678910"] is index.ou_map["SomeOU".lower()]  # The OU ID and name share the same set
+
+    # All the account sets are frozen so that callers can't accidentally modify the index:
+    assert isinstance(index.account_ids, frozenset)
+    assert all(isinstance(accounts, frozenset) for accounts in [*index.regions_map.values(), *index.ou_map.values()])
+    assert all(isinstance(accounts, frozenset) for tag_values in index.tag_map.values() for accounts in tag_values.values())
 
     for tag_values in index.tag_map.values():
         for values in tag_values.values():
             assert len(values) == len(account_map.keys())
 
 
+def test_same_named_ous(account_index_config: Dict[str, Any], aws_s3: BaseClient, inventory_bucket: str, index_obj: Dict[str, Any]) -> None:
+    """This tests that OUs that have the same name (but are in different parts of the Org) are only merged for lookups by OU name and not by OU ID."""
+    # Move accounts 1 and 2 into a different OU that is also named SomeOU:
+    for account_id in ["000000000001", "000000000002"]:
+        index_obj["accounts"][account_id]["Parents"][0] = {"Id": "ou-1234-other", "Type": "ORGANIZATIONAL_UNIT", "Name": "SomeOU"}
+    aws_s3.put_object(Bucket=inventory_bucket, Key="accountIndex.json", Body=json.dumps(index_obj))
+
+    index = StarfleetDefaultAccountIndex()
+    original_ou_accounts = index.get_accounts_by_ou("ou-1234-5678910")
+    other_ou_accounts = index.get_accounts_by_ou("ou-1234-other")
+    assert other_ou_accounts == {"000000000001", "000000000002"}
+    assert len(original_ou_accounts) == len(index_obj["accounts"].keys()) - 3  # 20 goes into the root and 1 and 2 are in the other OU
+    assert not original_ou_accounts.intersection(other_ou_accounts)
+
+    # The OU name returns back the accounts in both OUs:
+    assert index.get_accounts_by_ou("someou") == original_ou_accounts.union(other_ou_accounts)
+
+
+def test_parallel_download(account_index_config: Dict[str, Any], aws_s3: BaseClient, inventory_bucket: str, index_obj: Dict[str, Any]) -> None:
+    """This tests that larger indexes are fetched in parallel byte-range parts and properly re-assembled."""
+    from starfleet.account_index.plugins.starfleet_default_index.ship import _download_parallel, IncompleteIndexDownloadError
+
+    index_object = aws_s3.get_object(Bucket=inventory_bucket, Key="accountIndex.json")
+    expected = index_object["Body"].read()
+    etag = index_object["ETag"]
+
+    # Use a small part size that doesn't evenly divide the object so that the last part is a partial one:
+    assert _download_parallel(aws_s3, inventory_bucket, "accountIndex.json", etag, len(expected), part_size=1000, concurrency=4) == expected
+
+    # If the object was changed since it was measured, then the ETag won't match and S3 will reject the download:
+    with pytest.raises(ClientError) as cerr:
+        _download_parallel(aws_s3, inventory_bucket, "accountIndex.json", '"not-the-etag"', len(expected), part_size=1000, concurrency=4)
+    assert cerr.value.response["Error"]["Code"] == "PreconditionFailed"
+
+    # If a part comes back with a different size than what was requested, then that needs to be caught:
+    short_client = MagicMock()
+    short_client.get_object.return_value = {"Body": MagicMock(iter_chunks=MagicMock(return_value=[b"a" * 10]))}
+    with pytest.raises(IncompleteIndexDownloadError):
+        _download_parallel(short_client, inventory_bucket, "accountIndex.json", etag, len(expected), part_size=1000, concurrency=4)
+    assert short_client.get_object.call_args.kwargs["IfMatch"] == etag
+
+    # And verify that the index itself loads the same way when the object is larger than the part size:
+    with mock.patch("starfleet.account_index.plugins.starfleet_default_index.ship.INDEX_PART_SIZE", 1000):
+        index = StarfleetDefaultAccountIndex()
+        assert len(index.get_all_accounts()) == len(index_obj["accounts"].keys())
+    assert index.org_root == "000000000020"
+
+
+def test_lazy_load_only_once(index_obj: Dict[str, Any]) -> None:
+    """This tests that the index is only fetched from S3 once, even when it's queried from many threads at the same time."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    index = StarfleetDefaultAccountIndex()
+    with mock.patch.object(index, "_load_index", wraps=index._load_index) as mocked_load:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: index.get_all_accounts(), range(16)))
+
+    assert mocked_load.call_count == 1
+    assert all(len(accounts) == len(index_obj["accounts"].keys()) for accounts in results)
+
+
+def test_local_cache(account_index_config: Dict[str, Any], aws_s3: BaseClient, inventory_bucket: str, index_obj: Dict[str, Any], tmp_path: Any) -> None:
+    """This tests that the index is cached locally and only re-built from S3 when the S3 object changes."""
+    cache_path = str(tmp_path / "starfleet_index.cache")
+    account_index_config["StarfleetDefaultAccountIndex"]["IndexCachePath"] = cache_path
+
+    # The first load will fetch from S3 and write out the cache:
+    original = StarfleetDefaultAccountIndex()
+    assert len(original.get_all_accounts()) == len(index_obj["accounts"].keys())
+
+    # The second load should come from the cache:
+    index = StarfleetDefaultAccountIndex()
+    with mock.patch.object(index, "_load_inventory") as mocked_load_inventory:
+        assert index.get_all_accounts() == original.get_all_accounts()
+    assert not mocked_load_inventory.called
+    assert index.get_org_roots() == {"000000000020"}
+    assert index.ou_map == original.ou_map and index.tag_map == original.tag_map and index.alias_map == original.alias_map
+    assert index.ou_map["ou-1234-5678910"] is index.ou_map["someou"]  # The shared ID/name sets survive the round trip
+
+    # Update the index in S3 -- this changes the ETag, so the cache should not be used:
+    index_obj["accounts"].pop("000000000001")
+    aws_s3.put_object(Bucket=inventory_bucket, Key="accountIndex.json", Body=json.dumps(index_obj))
+    index = StarfleetDefaultAccountIndex()
+    assert len(index.get_all_accounts()) == len(index_obj["accounts"].keys())
+
+    # A cache for the same ETag that is from a different cache format version, or is missing any of the attributes, is ignored:
+    with open(cache_path, "rb") as file:
+        cached = pickle.load(file)
+    for bad_cache in [{**cached, "version": -1}, {key: value for key, value in cached.items() if key != "tag_map"}]:
+        bad_cache["org_root"] = "bad"
+        with open(cache_path, "wb") as file:
+            pickle.dump(bad_cache, file)
+        index = StarfleetDefaultAccountIndex()
+        assert index.get_org_roots() == {"000000000020"}  # Nothing from the bad cache was used
+        assert len(index.get_all_accounts()) == len(index_obj["accounts"].keys())
+
+    # A corrupted cache file is ignored:
+    with open(cache_path, "wb") as file:
+        file.write(b"not a pickle")
+    index = StarfleetDefaultAccountIndex()
+    assert len(index.get_all_accounts()) == len(index_obj["accounts"].keys())
+
+
 def test_get_accounts_by_id(index_obj: Dict[str, Any]) -> None:
     """This tests getting accounts by account ID."""
     index = StarfleetDefaultAccountIndex()
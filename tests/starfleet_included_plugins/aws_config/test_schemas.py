@@ -7,16 +7,143 @@ Tests out the schemas for configuration and payload to make sure they are correc
 :License: See the LICENSE file for details
 :Author: Mike Grima <michael.grima@gemini.com>
 """
-# pylint: disable=unused-argument
+# pylint: disable=unused-argument,redefined-outer-name
+from copy import deepcopy
+from typing import Any, Dict, Optional
+
 import boto3
 
 import pytest
 import yaml
 from marshmallow import ValidationError
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # pragma: no cover
+    from yaml import SafeLoader  # type: ignore
 
-def test_delivery_channel_details_schema() -> None:
-    """This tests that the DeliveryChannelDetails schema has proper validation."""
+
+# Payloads that are used across a number of the tests below. Each is only parsed once for the module by the fixtures below -- copy it before modifying it:
+DEFAULT_CONFIGURATION_PAYLOAD = """
+    DeliveryChannelDetails:
+        BucketName: some-bucket
+        S3DeliveryFrequency: Twelve_Hours
+        BucketKeyPrefix: some/prefix/
+        S3KmsKeyArn: arn:aws:kms:us-east-1:012345678912:key/1234abcd-1234ab-34cd-56ef-1234567890ab
+        SnsTopicArn: arn:aws:sns:us-east-1:012345678912:topic/some-topic
+        PreferredName: not-default
+    RecorderConfiguration:
+        ConfigRoleName: AWSConfigRole
+        RecordingEnabled: True
+        RecordingGroup:
+            ResourceTypes:
+                - ALL
+            GlobalsInRegions:
+                - us-east-1
+    RetentionPeriodInDays: 30
+"""
+
+ACCOUNT_OVERRIDE_PAYLOAD = """
+    IncludeAccounts:
+        ByNames:
+            - Some Enabled Account
+    IncludeRegions:
+        - ALL
+    ExcludeRegions:
+        - us-west-1
+    ExcludeAccounts:
+        ByNames:
+            - Some Disabled Account
+    DeliveryChannelDetails:
+        BucketName: some-bucket
+        S3DeliveryFrequency: Twelve_Hours
+        BucketKeyPrefix: some/prefix/
+        S3KmsKeyArn: arn:aws:kms:us-east-1:012345678912:key/1234abcd-1234ab-34cd-56ef-1234567890ab
+        SnsTopicArn: arn:aws:sns:us-east-1:012345678912:topic/some-topic
+        PreferredName: not-default
+    RecorderConfiguration:
+        ConfigRoleName: AWSConfigRole
+        RecordingEnabled: True
+        RecordingGroup:
+            ResourceTypes:
+                - ALL
+            GlobalsInRegions:
+                - us-east-1
+    RetentionPeriodInDays: 2557
+"""
+
+PAYLOAD_TEMPLATE = """
+    TemplateName: AWSConfig
+    TemplateDescription: Enabled AWS Config Everywhere
+    IncludeAccounts:
+        AllAccounts: True
+    IncludeRegions:
+        - ALL
+    DefaultConfiguration:
+        DeliveryChannelDetails:
+            BucketName: some-bucket
+            S3DeliveryFrequency: Twelve_Hours
+        RecorderConfiguration:
+            ConfigRoleName: AWSConfigRole
+            RecordingEnabled: True
+            RecordingGroup:
+                ResourceTypes:
+                    - ALL
+                GlobalsInRegions:
+                    - us-east-1
+        RetentionPeriodInDays: 2557
+    # For Some Override Account, we just want to record S3 buckets in all regions except for us-west-1:
+    AccountOverrideConfigurations:
+        -
+            IncludeAccounts:
+                ByNames:
+                    - Some Override Account
+            IncludeRegions:
+                - ALL
+            ExcludeRegions:
+                - us-west-1
+            DeliveryChannelDetails:
+                BucketName: some-bucket
+                S3DeliveryFrequency: Twelve_Hours
+            RecorderConfiguration:
+                ConfigRoleName: AWSConfigRole
+                RecordingEnabled: True
+                RecordingGroup:
+                    ResourceTypes:
+                        - AWS::S3::Bucket
+            RetentionPeriodInDays: 2557
+"""
+
+
+def load_yaml(payload: str) -> Any:
+    """Load the YAML payload with the libyaml backed safe loader (if available)."""
+    return yaml.load(payload, Loader=SafeLoader)
+
+
+@pytest.fixture(scope="module")
+def default_configuration_payload() -> Dict[str, Any]:
+    """This loads the default configuration payload."""
+    return load_yaml(DEFAULT_CONFIGURATION_PAYLOAD)
+
+
+@pytest.fixture(scope="module")
+def account_override_payload() -> Dict[str, Any]:
+    """This loads the account override payload."""
+    return load_yaml(ACCOUNT_OVERRIDE_PAYLOAD)
+
+
+@pytest.fixture(scope="module")
+def payload_template() -> Dict[str, Any]:
+    """This loads the full payload template."""
+    return load_yaml(PAYLOAD_TEMPLATE)
+
+
+# The regions that AWS Config is available in. This is loaded once for the whole module since it has to read the botocore endpoints data:
+_CONFIG_REGIONS = set(boto3.session.Session().get_available_regions("config"))
+
+
+def test_delivery_channel_details_defaults() -> None:
+    """This tests that the DeliveryChannelDetails schema fills in the proper defaults."""
     from starfleet.worker_ships.plugins.aws_config.schemas import DeliveryChannelDetails, DeliveryFrequency
 
     # Good (required only):
@@ -24,7 +151,7 @@ def test_delivery_channel_details_schema() -> None:
         BucketName: some-bucket
         S3DeliveryFrequency: Twelve_Hours
     """
-    assert DeliveryChannelDetails().load(yaml.safe_load(payload)) == {
+    assert DeliveryChannelDetails().load(load_yaml(payload)) == {
         "bucket_name": "some-bucket",
         "s3_delivery_frequency": DeliveryFrequency.Twelve_Hours,
         "bucket_key_prefix": None,
@@ -33,56 +160,87 @@ def test_delivery_channel_details_schema() -> None:
         "sns_topic_arn": None,
     }
 
-    # Good (All fields):
-    payload = """
-        BucketName: some-bucket
-        S3DeliveryFrequency: Twelve_Hours
-        BucketKeyPrefix: some/prefix/
-        S3KmsKeyArn: arn:aws:kms:us-east-1:012345678912:key/1234abcd-1234ab-34cd-56ef-1234567890ab
-        SnsTopicArn: arn:aws:sns:us-east-1:012345678912:topic/some-topic
-        PreferredName: not-default
-    """
-    assert DeliveryChannelDetails().load(yaml.safe_load(payload))
 
-    # Bad (missing required field):
-    payload = """
-        S3DeliveryFrequency: Twelve_Hours
-    """
-    with pytest.raises(ValidationError):
-        DeliveryChannelDetails().load(yaml.safe_load(payload))
+@pytest.mark.parametrize(
+    "payload, expected_error",
+    [
+        # Good (All fields):
+        (
+            """
+                BucketName: some-bucket
+                S3DeliveryFrequency: Twelve_Hours
+                BucketKeyPrefix: some/prefix/
+                S3KmsKeyArn: arn:aws:kms:us-east-1:012345678912:key/1234abcd-1234ab-34cd-56ef-1234567890ab
+                SnsTopicArn: arn:aws:sns:us-east-1:012345678912:topic/some-topic
+                PreferredName: not-default
+            """,
+            None,
+        ),
+        # Bad (missing required field):
+        ("S3DeliveryFrequency: Twelve_Hours", "BucketName"),
+        # Bad (Invalid delivery frequency):
+        ("S3DeliveryFrequency: pew-pew-pew", "S3DeliveryFrequency"),
+    ],
+)
+def test_delivery_channel_details_schema(payload: str, expected_error: Optional[str]) -> None:
+    """This tests that the DeliveryChannelDetails schema has proper validation."""
+    from starfleet.worker_ships.plugins.aws_config.schemas import DeliveryChannelDetails
 
-    # Bad (Invalid delivery frequency):
-    payload = """
-        S3DeliveryFrequency: pew-pew-pew
-    """
-    with pytest.raises(ValidationError):
-        DeliveryChannelDetails().load(yaml.safe_load(payload))
+    if not expected_error:
+        assert DeliveryChannelDetails().load(load_yaml(payload))
+        return
+
+    with pytest.raises(ValidationError) as exc:
+        DeliveryChannelDetails().load(load_yaml(payload))
+    assert expected_error in exc.value.messages
 
 
-def test_recording_group_schema() -> None:
+@pytest.mark.parametrize(
+    "payload, expected_error",
+    [
+        # Without specifying a resource type:
+        (
+            """
+                ResourceTypes: []  # Empty, which is bad
+                GlobalsInRegions:
+                    - us-east-1  # Doesn't matter
+            """,
+            {"ResourceTypes": ["Shorter than minimum length 1."]},
+        ),
+        # Specifying ALL and other things:
+        (
+            """
+                ResourceTypes:
+                  - some::resource::type
+                  - ALL
+                  - some::other::resource
+            """,
+            {"IncludeRegions": ["Can't specify any other resource types when `ALL` is specified in the list."]},
+        ),
+        # Specifying specific resources and also the GlobalsInRegions parameter:
+        (
+            """
+                ResourceTypes:
+                  - AWS::S3::Bucket
+                GlobalsInRegions:
+                    - us-east-1
+            """,
+            {"GlobalsInRegions": ["This field can only be specified with a list of regions if `ResourceTypes` is set to `- ALL`"]},
+        ),
+    ],
+)
+def test_recording_group_schema_errors(payload: str, expected_error: Dict[str, Any]) -> None:
     """This tests that the RecordingGroup schema has proper validation logic."""
     from starfleet.worker_ships.plugins.aws_config.schemas import RecordingGroup
 
-    # Without specifying a resource type
-    payload = """
-        ResourceTypes: []  # Empty, which is bad
-        GlobalsInRegions:
-            - us-east-1  # Doesn't matter
-    """
     with pytest.raises(ValidationError) as exc:
-        RecordingGroup().load(yaml.safe_load(payload))
-    assert exc.value.messages == {"ResourceTypes": ["Shorter than minimum length 1."]}
+        RecordingGroup().load(load_yaml(payload))
+    assert exc.value.messages == expected_error
 
-    # Specifying ALL and other things:
-    payload = """
-        ResourceTypes:
-          - some::resource::type
-          - ALL
-          - some::other::resource
-    """
-    with pytest.raises(ValidationError) as exc:
-        RecordingGroup().load(yaml.safe_load(payload))
-    assert exc.value.messages == {"IncludeRegions": ["Can't specify any other resource types when `ALL` is specified in the list."]}
+
+def test_recording_group_schema_invalid_regions() -> None:
+    """This tests that the RecordingGroup schema rejects regions that don't exist."""
+    from starfleet.worker_ships.plugins.aws_config.schemas import RecordingGroup
 
     # Specifying ALL and regions that don't exist:
     payload = """
@@ -95,37 +253,40 @@ def test_recording_group_schema() -> None:
             - pew-pew-pew
     """
     with pytest.raises(ValidationError) as exc:
-        RecordingGroup().load(yaml.safe_load(payload))
+        RecordingGroup().load(load_yaml(payload))
     for bad_region in ["not-a-region", "pew-pew-pew"]:
         assert bad_region in exc.value.messages["GlobalsInRegions"][0]
 
-    # Specifying specific resources and also the GlobalsInRegions parameter:
-    payload = """
-        ResourceTypes:
-          - AWS::S3::Bucket
-        GlobalsInRegions:
-            - us-east-1
-    """
-    with pytest.raises(ValidationError) as exc:
-        RecordingGroup().load(yaml.safe_load(payload))
-    assert exc.value.messages == {"GlobalsInRegions": ["This field can only be specified with a list of regions if `ResourceTypes` is set to `- ALL`"]}
 
-    # Good (all):
-    payload = """
-        ResourceTypes:
-          - ALL
-        GlobalsInRegions:
-            - us-east-1
-    """
-    assert RecordingGroup().load(yaml.safe_load(payload)) == {"resource_types": ["ALL"], "globals_in_regions": ["us-east-1"]}
+@pytest.mark.parametrize(
+    "payload, expected",
+    [
+        # Good (all):
+        (
+            """
+                ResourceTypes:
+                  - ALL
+                GlobalsInRegions:
+                    - us-east-1
+            """,
+            {"resource_types": ["ALL"], "globals_in_regions": ["us-east-1"]},
+        ),
+        # Good (not all):
+        (
+            """
+                ResourceTypes:
+                  - AWS::S3::Bucket
+                  - AWS::IAM::Role
+            """,
+            {"resource_types": ["AWS::S3::Bucket", "AWS::IAM::Role"]},
+        ),
+    ],
+)
+def test_recording_group_schema(payload: str, expected: Dict[str, Any]) -> None:
+    """This tests that the RecordingGroup schema properly loads valid recording groups."""
+    from starfleet.worker_ships.plugins.aws_config.schemas import RecordingGroup
 
-    # Good (not all)
-    payload = """
-        ResourceTypes:
-          - AWS::S3::Bucket
-          - AWS::IAM::Role
-    """
-    assert RecordingGroup().load(yaml.safe_load(payload)) == {"resource_types": ["AWS::S3::Bucket", "AWS::IAM::Role"]}
+    assert RecordingGroup().load(load_yaml(payload)) == expected
 
 
 def test_recorder_configuration_schema() -> None:
@@ -142,7 +303,7 @@ def test_recorder_configuration_schema() -> None:
             GlobalsInRegions:
                 - us-east-1
     """
-    assert RecorderConfiguration().load(yaml.safe_load(payload)) == {
+    assert RecorderConfiguration().load(load_yaml(payload)) == {
         "config_role_name": "AWSConfigRole",
         "recording_enabled": True,
         "recording_group": {"resource_types": ["ALL"], "globals_in_regions": ["us-east-1"]},
@@ -151,35 +312,16 @@ def test_recorder_configuration_schema() -> None:
 
     # Bad:
     with pytest.raises(ValidationError) as exc:
-        RecorderConfiguration().load(yaml.safe_load("PreferredName: PewPewPew"))
+        RecorderConfiguration().load(load_yaml("PreferredName: PewPewPew"))
     assert exc.value.messages == {"ConfigRoleName": ["Missing data for required field."], "RecordingGroup": ["Missing data for required field."]}
 
 
-def test_all_accounts_configuration() -> None:
+def test_all_accounts_configuration(default_configuration_payload: Dict[str, Any]) -> None:
     """This tests that the DefaultConfiguration schema has proper validation logic."""
     from starfleet.worker_ships.plugins.aws_config.schemas import DefaultConfiguration
 
-    # Good:
-    payload = """
-        DeliveryChannelDetails:
-            BucketName: some-bucket
-            S3DeliveryFrequency: Twelve_Hours
-            BucketKeyPrefix: some/prefix/
-            S3KmsKeyArn: arn:aws:kms:us-east-1:012345678912:key/1234abcd-1234ab-34cd-56ef-1234567890ab
-            SnsTopicArn: arn:aws:sns:us-east-1:012345678912:topic/some-topic
-            PreferredName: not-default
-        RecorderConfiguration:
-            ConfigRoleName: AWSConfigRole
-            RecordingEnabled: True
-            RecordingGroup:
-                ResourceTypes:
-                    - ALL
-                GlobalsInRegions:
-                    - us-east-1
-        RetentionPeriodInDays: 30
-    """
-    # Just verify that some of the fields are good:
-    loaded = DefaultConfiguration().load(yaml.safe_load(payload))
+    # Good -- just verify that some of the fields are good:
+    loaded = DefaultConfiguration().load(default_configuration_payload)
     assert loaded["delivery_channel_details"]["bucket_name"] == "some-bucket"
     assert loaded["recorder_configuration"]["recording_group"]["resource_types"] == ["ALL"]
 
@@ -193,57 +335,28 @@ def test_all_accounts_configuration() -> None:
     }
 
 
-def test_account_override_configuration() -> None:
+def test_account_override_configuration(account_override_payload: Dict[str, Any]) -> None:
     """This tests that the AccountOverrideConfiguration schema has proper validation logic."""
     from starfleet.worker_ships.plugins.aws_config.schemas import AccountOverrideConfiguration
 
-    # Good:
-    payload = """
-        IncludeAccounts:
-            ByNames:
-                - Some Enabled Account
-        IncludeRegions:
-            - ALL
-        ExcludeRegions:
-            - us-west-1
-        ExcludeAccounts:
-            ByNames:
-                - Some Disabled Account
-        DeliveryChannelDetails:
-            BucketName: some-bucket
-            S3DeliveryFrequency: Twelve_Hours
-            BucketKeyPrefix: some/prefix/
-            S3KmsKeyArn: arn:aws:kms:us-east-1:012345678912:key/1234abcd-1234ab-34cd-56ef-1234567890ab
-            SnsTopicArn: arn:aws:sns:us-east-1:012345678912:topic/some-topic
-            PreferredName: not-default
-        RecorderConfiguration:
-            ConfigRoleName: AWSConfigRole
-            RecordingEnabled: True
-            RecordingGroup:
-                ResourceTypes:
-                    - ALL
-                GlobalsInRegions:
-                    - us-east-1
-        RetentionPeriodInDays: 2557
-    """
-    # Just verify that some of the fields are good:
-    loaded = AccountOverrideConfiguration().load(yaml.safe_load(payload))
+    # Good -- just verify that some of the fields are good:
+    loaded = AccountOverrideConfiguration().load(account_override_payload)
     assert loaded["include_accounts"]["by_names"] == ["Some Enabled Account"]
-    assert loaded["include_regions"] == set(boto3.session.Session().get_available_regions("config"))
+    assert loaded["include_regions"] == _CONFIG_REGIONS
     assert loaded["exclude_regions"] == {"us-west-1"}
     assert loaded["exclude_accounts"]["by_names"] == ["Some Disabled Account"]
     assert loaded["delivery_channel_details"]["bucket_name"] == "some-bucket"
     assert loaded["recorder_configuration"]["recording_group"]["resource_types"] == ["ALL"]
 
     # Good with specific regions mentioned:
-    good_regions = yaml.safe_load(payload)
+    good_regions = deepcopy(account_override_payload)
     good_regions["IncludeRegions"] = ["us-east-1", "us-east-2"]
     loaded = AccountOverrideConfiguration().load(good_regions)
     assert loaded["include_regions"] == {"us-east-1", "us-east-2"}
 
     # Now, confirm the exclude/include region logic with bad regions:
     with pytest.raises(ValidationError) as exc:
-        bad_regions = yaml.safe_load(payload)
+        bad_regions = deepcopy(account_override_payload)
         bad_regions["ExcludeRegions"].append("pewpewpew")
         bad_regions["IncludeRegions"] = ["pewpewpew"]
         AccountOverrideConfiguration().load(bad_regions)
@@ -252,7 +365,7 @@ def test_account_override_configuration() -> None:
 
     # Specify region to include in addition to ALL:
     with pytest.raises(ValidationError) as exc:
-        bad_regions = yaml.safe_load(payload)
+        bad_regions = deepcopy(account_override_payload)
         bad_regions["IncludeRegions"] = ["us-east-1", "ALL"]
         AccountOverrideConfiguration().load(bad_regions)
     assert exc.value.messages == {"IncludeRegions": ["Can't specify any other regions when `ALL` is specified in the list."]}
@@ -269,54 +382,12 @@ def test_account_override_configuration() -> None:
     }
 
 
-def test_payload_template() -> None:
+def test_payload_template(payload_template: Dict[str, Any]) -> None:
     """This tests that the AwsConfigWorkerShipPayloadTemplate schema has proper validation logic."""
     from starfleet.worker_ships.plugins.aws_config.schemas import AwsConfigWorkerShipPayloadTemplate
 
-    # Good:
-    payload = """
-        TemplateName: AWSConfig
-        TemplateDescription: Enabled AWS Config Everywhere
-        IncludeAccounts:
-            AllAccounts: True
-        IncludeRegions:
-            - ALL
-        DefaultConfiguration:
-            DeliveryChannelDetails:
-                BucketName: some-bucket
-                S3DeliveryFrequency: Twelve_Hours
-            RecorderConfiguration:
-                ConfigRoleName: AWSConfigRole
-                RecordingEnabled: True
-                RecordingGroup:
-                    ResourceTypes:
-                        - ALL
-                    GlobalsInRegions:
-                        - us-east-1
-            RetentionPeriodInDays: 2557
-        # For Some Override Account, we just want to record S3 buckets in all regions except for us-west-1:
-        AccountOverrideConfigurations:
-            -
-                IncludeAccounts:
-                    ByNames:
-                        - Some Override Account
-                IncludeRegions:
-                    - ALL
-                ExcludeRegions:
-                    - us-west-1
-                DeliveryChannelDetails:
-                    BucketName: some-bucket
-                    S3DeliveryFrequency: Twelve_Hours
-                RecorderConfiguration:
-                    ConfigRoleName: AWSConfigRole
-                    RecordingEnabled: True
-                    RecordingGroup:
-                        ResourceTypes:
-                            - AWS::S3::Bucket
-                RetentionPeriodInDays: 2557
-    """
-    # Just confirm that we can load it all:
-    assert AwsConfigWorkerShipPayloadTemplate().load(yaml.safe_load(payload))
+    # Good -- just confirm that we can load it all:
+    assert AwsConfigWorkerShipPayloadTemplate().load(payload_template)
 
     # Confirm missing stuff:
     with pytest.raises(ValidationError) as exc:
@@ -328,5 +399,5 @@ def test_payload_template() -> None:
             IncludeRegions:
                 - ALL
         """
-        AwsConfigWorkerShipPayloadTemplate().load(yaml.safe_load(payload))
+        AwsConfigWorkerShipPayloadTemplate().load(load_yaml(payload))
     assert exc.value.messages == {"DefaultConfiguration": ["Missing data for required field."]}